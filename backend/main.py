@@ -3,22 +3,36 @@ PharmaGuard - Main FastAPI Application
 Pharmacogenomic Risk Prediction System
 """
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel
+import asyncio
+import functools
+import hashlib
+import io
+import openai
+import os
+import time
 import uuid
 import json
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Optional, List
 
-from vcf_parser import parse_vcf, get_sample_vcf
-from risk_engine import assess_risk, get_supported_drugs, get_phenotype
-from llm_explainer import generate_explanation
+from vcf_parser import Variant, parse_vcf, get_sample_vcf
+from risk_engine import assess_risk, get_supported_drugs, get_phenotype, RISK_ADJUST_DOSAGE, RISK_TOXIC
+from llm_explainer import (
+    generate_explanation, build_prompt, parse_llm_response,
+    SYSTEM_MESSAGE, OPENAI_MODEL, MAX_COMPLETION_TOKENS, PROMPT_VERSION
+)
 
 app = FastAPI(
     title="PharmaGuard API",
     description="Pharmacogenomic Risk Prediction System",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS — allow frontend to call backend
@@ -30,6 +44,106 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def _create_process_pool():
+    # Rule-based (no API key) assessments are pure CPU — fan them out
+    # across cores instead of serializing on the event-loop thread
+    app.state.process_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+
+
+@app.on_event("shutdown")
+def _shutdown_process_pool():
+    app.state.process_pool.shutdown(wait=False)
+
+
+class AnalyzeResult(BaseModel):
+    """
+    Full per-drug result. Built with model_construct — every field comes
+    from our own code, so the per-field validation pass is skipped.
+    """
+    patient_id: str
+    drug: str
+    timestamp: str
+    risk_assessment: dict
+    pharmacogenomic_profile: dict
+    clinical_recommendation: dict
+    llm_generated_explanation: dict
+    quality_metrics: dict
+
+
+# ─────────────────────────────────────────────────────────────
+# RESPONSE CACHE
+# Retries, UI refreshes, and shared demos hit /analyze repeatedly with
+# the same VCF + drug list. Cache the encoded response keyed by a hash
+# of the upload content, drug list, and prompt version; the hash doubles
+# as the ETag so clients can revalidate with If-None-Match.
+# ─────────────────────────────────────────────────────────────
+
+RESPONSE_CACHE_TTL = 3600  # seconds
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+
+_response_cache: dict = {}  # req_hash -> (expires_at, encoded payload)
+
+
+def _response_cache_get(req_hash: str) -> Optional[dict]:
+    entry = _response_cache.get(req_hash)
+    if entry is None:
+        return None
+    expires_at, payload = entry
+    if time.time() > expires_at:
+        del _response_cache[req_hash]
+        return None
+    return payload
+
+
+def _response_cache_put(req_hash: str, payload: dict) -> None:
+    if len(_response_cache) >= RESPONSE_CACHE_MAX_ENTRIES:
+        # Evict oldest insertion — dicts preserve insertion order
+        _response_cache.pop(next(iter(_response_cache)), None)
+    _response_cache[req_hash] = (time.time() + RESPONSE_CACHE_TTL, payload)
+
+
+# Cap concurrent per-drug assessments — each one may hold an OpenAI call open
+MAX_CONCURRENT_DRUGS = 10
+_drug_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DRUGS)
+
+
+async def build_results_concurrently(patient_id: str, drug_list: List[str], parsed_vcf: dict, api_key: Optional[str] = None) -> List[AnalyzeResult]:
+    """
+    Assess all drugs concurrently instead of serializing N LLM round trips.
+    build_result blocks on the OpenAI HTTP call, so each drug runs in a
+    worker thread; the semaphore bounds how many are in flight at once.
+    """
+    # One timestamp per request — cheaper than a clock read per drug and
+    # keeps all of a patient's results consistent
+    timestamp = datetime.utcnow().isoformat() + "Z"
+    variant_lists = build_variant_lists(parsed_vcf)
+
+    # Without an API key build_result is pure CPU (dict lookups + template
+    # formatting), so spread the drugs across the process pool; with a key
+    # the work is network-bound and threads suffice
+    pool = getattr(app.state, "process_pool", None)
+    if pool is not None and api_key is None and not os.environ.get("OPENAI_API_KEY"):
+        loop = asyncio.get_running_loop()
+        return list(await asyncio.gather(*[
+            loop.run_in_executor(pool, build_result, patient_id, drug, parsed_vcf, None, timestamp, variant_lists)
+            for drug in drug_list
+        ]))
+
+    async def run_one(drug: str) -> AnalyzeResult:
+        async with _drug_semaphore:
+            return await asyncio.to_thread(
+                build_result,
+                patient_id=patient_id,
+                drug=drug,
+                parsed_vcf=parsed_vcf,
+                api_key=api_key,
+                timestamp=timestamp,
+                variant_lists=variant_lists
+            )
+
+    return list(await asyncio.gather(*[run_one(drug) for drug in drug_list]))
+
 
 @app.get("/")
 def root():
@@ -44,6 +158,7 @@ def list_drugs():
 
 @app.post("/analyze")
 async def analyze(
+    request: Request,
     vcf_file: UploadFile = File(...),
     drugs: str = Form(...),
     patient_id: Optional[str] = Form(None),
@@ -52,47 +167,70 @@ async def analyze(
     """
     Main analysis endpoint.
     Accepts VCF file + drug names, returns pharmacogenomic risk assessment.
+    Identical (VCF, drugs) requests within the cache TTL are answered from
+    the response cache; the content hash is exposed as an ETag.
     """
     # Validate file type
     if not vcf_file.filename.endswith(".vcf"):
         raise HTTPException(status_code=400, detail="Only .vcf files are supported.")
 
-    # Read file content
-    content = await vcf_file.read()
+    # Parse drug list
+    drug_list = [d.strip().upper() for d in drugs.split(",") if d.strip()]
+    if not drug_list:
+        raise HTTPException(status_code=400, detail="Please provide at least one drug name.")
+
+    # Hash the upload in a streaming pass (O(chunk) memory), then rewind
+    hasher = hashlib.sha256()
+    while chunk := vcf_file.file.read(1024 * 1024):
+        hasher.update(chunk)
+    vcf_file.file.seek(0)
+    hasher.update(drugs.encode("utf-8"))
+    hasher.update((patient_id or "").encode("utf-8"))
+    hasher.update(PROMPT_VERSION.encode("utf-8"))
+    # The caller's key changes the response body (LLM vs rule-based
+    # explanations), so keyed and keyless requests must cache apart —
+    # hash a digest of the key, never the key itself
+    if openai_api_key:
+        hasher.update(hashlib.sha256(openai_api_key.encode("utf-8")).digest())
+    req_hash = hasher.hexdigest()
+
+    if request.headers.get("if-none-match") == req_hash:
+        return Response(status_code=304)
+
+    cached = _response_cache_get(req_hash)
+    if cached is not None:
+        return ORJSONResponse(content=cached, headers={"ETag": req_hash})
+
+    # Stream the upload line-by-line instead of loading the whole file —
+    # keeps peak memory at O(line) rather than O(filesize) for large VCFs
+    text_stream = io.TextIOWrapper(vcf_file.file, encoding="utf-8")
     try:
-        vcf_content = content.decode("utf-8")
+        parsed = await asyncio.to_thread(parse_vcf, text_stream)
     except UnicodeDecodeError:
         raise HTTPException(status_code=400, detail="VCF file must be UTF-8 encoded text.")
 
-    # Parse VCF
-    parsed = parse_vcf(vcf_content)
-
     if not parsed["vcf_parsing_success"]:
         raise HTTPException(status_code=422, detail="VCF file could not be parsed. Please check the file format.")
 
-    # Parse drug list
-    drug_list = [d.strip().upper() for d in drugs.split(",") if d.strip()]
-    if not drug_list:
-        raise HTTPException(status_code=400, detail="Please provide at least one drug name.")
-
-    # Generate results for each drug
-    results = []
+    # Generate results for all drugs concurrently
     pid = patient_id or f"PATIENT_{str(uuid.uuid4())[:6].upper()}"
+    results = await build_results_concurrently(pid, drug_list, parsed, openai_api_key)
 
-    for drug in drug_list:
-        result = build_result(
-            patient_id=pid,
-            drug=drug,
-            parsed_vcf=parsed,
-            api_key=openai_api_key
-        )
-        results.append(result)
-
-    # Return single result if one drug, list if multiple
+    # Single result if one drug, list if multiple
     if len(results) == 1:
-        return JSONResponse(content=results[0])
+        payload = jsonable_encoder(results[0])
     else:
-        return JSONResponse(content={"patient_id": pid, "results": results})
+        payload = jsonable_encoder({"patient_id": pid, "results": results})
+
+    _response_cache_put(req_hash, payload)
+    return ORJSONResponse(content=payload, headers={"ETag": req_hash})
+
+
+@functools.lru_cache(maxsize=1)
+def _sample_parsed() -> dict:
+    """Parse the static demo VCF once — every /analyze/sample hit reuses it.
+    Downstream code only reads the parsed dict, so sharing it is safe."""
+    return parse_vcf(get_sample_vcf())
 
 
 @app.post("/analyze/sample")
@@ -103,55 +241,197 @@ async def analyze_sample(
     """
     Analyze using the built-in sample VCF file for demo/testing.
     """
-    sample_vcf = get_sample_vcf()
-    parsed = parse_vcf(sample_vcf)
+    parsed = _sample_parsed()
 
     drug_list = [d.strip().upper() for d in drugs.split(",") if d.strip()]
     pid = "PATIENT_DEMO01"
 
-    results = []
-    for drug in drug_list:
-        result = build_result(
-            patient_id=pid,
-            drug=drug,
-            parsed_vcf=parsed,
-            api_key=openai_api_key
-        )
-        results.append(result)
+    results = await build_results_concurrently(pid, drug_list, parsed, openai_api_key)
 
     if len(results) == 1:
-        return JSONResponse(content=results[0])
+        return results[0]
     else:
-        return JSONResponse(content={"patient_id": pid, "results": results})
+        return {"patient_id": pid, "results": results}
+
 
+# Pending batch jobs: batch_id -> {custom_id: rule-based result skeleton}.
+# The skeleton's explanation is swapped for the LLM one once the batch completes.
+_batch_jobs: dict = {}
 
-def build_result(patient_id: str, drug: str, parsed_vcf: dict, api_key: Optional[str] = None) -> dict:
-    """Build the full result JSON for a drug."""
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    vcf_files: List[UploadFile] = File(...),
+    drugs: str = Form(...),
+    openai_api_key: Optional[str] = Form(None)
+):
+    """
+    Bulk analysis via the OpenAI Batch API — half the cost of real-time
+    calls, with up to 24h turnaround. Returns a batch_id to poll via
+    GET /analyze/batch/{batch_id}.
+    """
+    key = openai_api_key or os.environ.get("OPENAI_API_KEY")
+    if not key:
+        raise HTTPException(status_code=400, detail="OpenAI API key required for batch analysis.")
+
+    drug_list = [d.strip().upper() for d in drugs.split(",") if d.strip()]
+    if not drug_list:
+        raise HTTPException(status_code=400, detail="Please provide at least one drug name.")
+
+    jsonl_lines = []
+    skeletons = {}
+    timestamp = datetime.utcnow().isoformat() + "Z"
+
+    for vcf_file in vcf_files:
+        if not vcf_file.filename.endswith(".vcf"):
+            raise HTTPException(status_code=400, detail=f"'{vcf_file.filename}' is not a .vcf file.")
+
+        content = await vcf_file.read()
+        try:
+            vcf_content = content.decode("utf-8")
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail=f"'{vcf_file.filename}' must be UTF-8 encoded text.")
+
+        parsed = parse_vcf(vcf_content)
+        if not parsed["vcf_parsing_success"]:
+            raise HTTPException(status_code=422, detail=f"'{vcf_file.filename}' could not be parsed.")
+
+        pid = f"PATIENT_{str(uuid.uuid4())[:6].upper()}"
+        variant_lists = build_variant_lists(parsed)
+
+        for drug in drug_list:
+            # Rule-based skeleton now; LLM explanation merged in on completion
+            skeleton = build_result(patient_id=pid, drug=drug, parsed_vcf=parsed, api_key=None, timestamp=timestamp, variant_lists=variant_lists)
+            custom_id = f"{pid}:{drug}"
+            skeletons[custom_id] = skeleton
+
+            prompt = build_prompt(
+                drug=drug,
+                gene=skeleton.pharmacogenomic_profile["primary_gene"],
+                diplotype=skeleton.pharmacogenomic_profile["diplotype"],
+                phenotype=skeleton.pharmacogenomic_profile["phenotype"],
+                risk_label=skeleton.risk_assessment["risk_label"],
+                severity=skeleton.risk_assessment["severity"],
+                recommendation=skeleton.clinical_recommendation["recommendation"],
+                detected_variants=skeleton.pharmacogenomic_profile["detected_variants"]
+            )
+            jsonl_lines.append(json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": OPENAI_MODEL,
+                    "messages": [
+                        {"role": "system", "content": SYSTEM_MESSAGE},
+                        {"role": "user", "content": prompt}
+                    ],
+                    "max_tokens": MAX_COMPLETION_TOKENS,
+                    "temperature": 0.3,
+                    "response_format": {"type": "json_object"}
+                }
+            }))
+
+    client = openai.OpenAI(api_key=key)
+    batch_file = client.files.create(
+        file=io.BytesIO("\n".join(jsonl_lines).encode("utf-8")),
+        purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+
+    _batch_jobs[batch.id] = skeletons
+
+    return {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "total_requests": len(jsonl_lines)
+    }
+
+
+@app.get("/analyze/batch/{batch_id}")
+async def get_batch_results(batch_id: str, openai_api_key: Optional[str] = None):
+    """Poll a batch job; returns merged results once the batch completes."""
+    key = openai_api_key or os.environ.get("OPENAI_API_KEY")
+    if not key:
+        raise HTTPException(status_code=400, detail="OpenAI API key required.")
+
+    skeletons = _batch_jobs.get(batch_id)
+    if skeletons is None:
+        raise HTTPException(status_code=404, detail="Unknown batch_id.")
+
+    client = openai.OpenAI(api_key=key)
+    batch = client.batches.retrieve(batch_id)
+
+    if batch.status != "completed":
+        return {"batch_id": batch_id, "status": batch.status}
+
+    output = client.files.content(batch.output_file_id).text
+    for line in output.strip().split("\n"):
+        if not line:
+            continue
+        entry = json.loads(line)
+        skeleton = skeletons.get(entry.get("custom_id"))
+        if skeleton is None:
+            continue
+        response_body = (entry.get("response") or {}).get("body") or {}
+        choices = response_body.get("choices") or []
+        if not choices:
+            continue
+        explanation = parse_llm_response(choices[0]["message"]["content"])
+        skeleton.llm_generated_explanation = explanation
+        skeleton.quality_metrics["explanation_source"] = explanation["generated_by"]
+
+    return {
+        "batch_id": batch_id,
+        "status": batch.status,
+        "results": list(skeletons.values())
+    }
+
+
+def _to_variant_dict(v: Variant) -> dict:
+    """Trim a parsed variant down to the fields exposed in the response."""
+    return {
+        "rsid": v.rsid,
+        "chromosome": v.chromosome,
+        "position": v.position,
+        "ref_allele": v.ref_allele,
+        "alt_allele": v.alt_allele,
+        "gene": v.gene,
+        "star_allele": v.star_allele
+    }
+
+
+def build_variant_lists(parsed_vcf: dict) -> dict:
+    """Response-shaped variant lists per gene — built once per request so
+    N drugs sharing a gene don't each rebuild the same list."""
+    return {
+        gene: [_to_variant_dict(v) for v in variants]
+        for gene, variants in parsed_vcf.get("gene_variants", {}).items()
+    }
+
+
+def build_result(patient_id: str, drug: str, parsed_vcf: dict, api_key: Optional[str] = None, timestamp: Optional[str] = None, variant_lists: Optional[dict] = None) -> AnalyzeResult:
+    """Build the full result for a drug."""
+
+    if timestamp is None:
+        timestamp = datetime.utcnow().isoformat() + "Z"
+    if variant_lists is None:
+        variant_lists = build_variant_lists(parsed_vcf)
 
     diplotypes = parsed_vcf.get("diplotypes", {})
-    gene_variants = parsed_vcf.get("gene_variants", {})
 
-    # Get risk assessment
+    # Get risk assessment — risk.record is a shared immutable table entry
     risk = assess_risk(drug, diplotypes)
 
-    primary_gene = risk["primary_gene"]
-    phenotype = risk["phenotype"]
-    diplotype = risk["diplotype"]
+    primary_gene = risk.primary_gene
+    phenotype = risk.phenotype
+    diplotype = risk.diplotype
 
     # Get detected variants for primary gene
-    detected_variants = gene_variants.get(primary_gene, [])
-    variant_list = [
-        {
-            "rsid": v.get("rsid", ""),
-            "chromosome": v.get("chromosome", ""),
-            "position": v.get("position", ""),
-            "ref_allele": v.get("ref_allele", ""),
-            "alt_allele": v.get("alt_allele", ""),
-            "gene": v.get("gene", ""),
-            "star_allele": v.get("star_allele", "")
-        }
-        for v in detected_variants
-    ]
+    variant_list = variant_lists.get(primary_gene, [])
 
     # Generate LLM explanation
     explanation = generate_explanation(
@@ -159,43 +439,44 @@ def build_result(patient_id: str, drug: str, parsed_vcf: dict, api_key: Optional
         gene=primary_gene,
         diplotype=diplotype,
         phenotype=phenotype,
-        risk_label=risk["risk_label"],
-        severity=risk["severity"],
-        recommendation=risk["recommendation"],
+        risk_label=risk.record.risk_label,
+        severity=risk.record.severity,
+        recommendation=risk.record.recommendation,
         detected_variants=variant_list,
-        api_key=api_key
+        api_key=api_key,
+        timestamp=timestamp
     )
 
-    return {
-        "patient_id": patient_id,
-        "drug": drug,
-        "timestamp": datetime.utcnow().isoformat() + "Z",
-        "risk_assessment": {
-            "risk_label": risk["risk_label"],
-            "confidence_score": risk["confidence_score"],
-            "severity": risk["severity"]
+    return AnalyzeResult.model_construct(
+        patient_id=patient_id,
+        drug=drug,
+        timestamp=timestamp,
+        risk_assessment={
+            "risk_label": risk.record.risk_label,
+            "confidence_score": risk.record.confidence_score,
+            "severity": risk.record.severity
         },
-        "pharmacogenomic_profile": {
+        pharmacogenomic_profile={
             "primary_gene": primary_gene,
             "diplotype": diplotype,
             "phenotype": phenotype,
             "detected_variants": variant_list
         },
-        "clinical_recommendation": {
-            "recommendation": risk["recommendation"],
-            "cpic_recommendation": risk["cpic_recommendation"],
-            "requires_dose_adjustment": risk["risk_label"] in ["Adjust Dosage", "Toxic"],
-            "contraindicated": risk["risk_label"] == "Toxic" and risk["severity"] == "critical"
+        clinical_recommendation={
+            "recommendation": risk.record.recommendation,
+            "cpic_recommendation": risk.record.cpic_recommendation,
+            "requires_dose_adjustment": risk.record.risk_label in (RISK_ADJUST_DOSAGE, RISK_TOXIC),
+            "contraindicated": risk.record.risk_label is RISK_TOXIC and risk.record.severity == "critical"
         },
-        "llm_generated_explanation": explanation,
-        "quality_metrics": {
+        llm_generated_explanation=explanation,
+        quality_metrics={
             "vcf_parsing_success": parsed_vcf.get("vcf_parsing_success", False),
             "total_variants_parsed": parsed_vcf.get("total_variants_found", 0),
             "genes_detected": parsed_vcf.get("genes_detected", []),
             "primary_gene_found": primary_gene in parsed_vcf.get("genes_detected", []),
             "explanation_source": explanation.get("generated_by", "unknown")
         }
-    }
+    )
 
 
 if __name__ == "__main__":
